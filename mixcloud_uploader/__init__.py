@@ -1,27 +1,46 @@
 import argparse
-import json
+import functools
+import hashlib
 import re
 import os
+import shlex
+import shutil
 import subprocess
 import sys
+import time
 
 from dataclasses import dataclass
 from pathlib import Path
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from tracklist.format.cuesheet import CuesheetFormat
-from tracklist.format.tabular import TabularFormat
-from typing import Optional
+from tempfile import TemporaryDirectory, mkstemp
+from typing import TYPE_CHECKING, Optional
 
-from mixcloud_uploader.mixcloud import Mixcloud, authenticate_via_browser
-from mixcloud_uploader.transform import complete_tracklist, trim_tracklist
-from mixcloud_uploader.transcode import transcode
-from mixcloud_uploader.utils import confirm, input_with_default, pretty_box
+from mixcloud_uploader.utils import confirm, format_json, input_with_default, link_or_copy, pretty_box, read_json, write_atomically
+
+# The heavier modules (HTTP client, tracklist parser, transcoder) are
+# imported lazily where needed to keep e.g. `--help` snappy.
+if TYPE_CHECKING:
+    from mixcloud_uploader.mixcloud import Mixcloud
 
 DEFAULT_CONFIG_DIR = Path.home() / '.config' / 'mixcloud-uploader'
 DEFAULT_CONFIG_PATH = DEFAULT_CONFIG_DIR / 'config.json'
 DEFAULT_AUTH_PATH = DEFAULT_CONFIG_DIR / 'auth.json'
+DEFAULT_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'mixcloud-uploader'
+DEFAULT_MIXES_CACHE_PATH = DEFAULT_CACHE_DIR / 'mixes.json'
+DEFAULT_TRANSCODES_CACHE_DIR = DEFAULT_CACHE_DIR / 'transcodes'
 DEFAULT_RECORDINGS_PATH = Path.home() / 'Music' / 'Mixxx' / 'Recordings'
 
+# The duration in seconds for which the cached list of mixes is reused.
+MIXES_CACHE_TTL = 300
+# The number of most recently used transcodes to keep in the cache.
+TRANSCODES_CACHE_SIZE = 3
+# The age in seconds after which leftover temporary files in the cache are removed.
+STALE_TEMPORARY_FILE_AGE = 24 * 60 * 60
+
+# Matches the capturing group of a name pattern.
+NAME_GROUP_PATTERN = re.compile(r'\([^\)]+\)')
+# Matches the separators (including surrounding whitespace) of a comma-separated list of tags.
+TAG_SEPARATOR_PATTERN = re.compile(r'\s*,\s*')
+
 @dataclass
 class Options:
     # The path to the raw recording (a Mixxx-generated wav).
@@ -30,10 +49,14 @@ class Options:
     tracklist_path: Path
     # The path to the transcoded mp3.
     output_path: Path
+    # The path at which the transcoded mp3 is cached across runs, if enabled.
+    transcode_cache_path: Optional[Path]
     # Whether to run noninteractively.
     noninteractive: bool
     # The API wrapper.
-    mixcloud: Mixcloud
+    mixcloud: 'Mixcloud'
+    # The path to the cached list of mixes, which is invalidated after uploading.
+    mixes_cache_path: Optional[Path]
     # The name for the uplaoded mix.
     name: str
     # The description for the uploaded mix.
@@ -49,71 +72,173 @@ class Options:
     # Optionally a duration in seconds to fade out.
     fade_out: Optional[float]
 
+@functools.cache
+def editor_command() -> list[str]:
+    """Resolves the user's editor command, which may include arguments (e.g. 'code --wait')."""
+    command = shlex.split(os.environ.get('EDITOR', '')) or ['vim']
+    command[0] = shutil.which(command[0]) or command[0]
+    return command
+
 def find_latest_recording(recordings_dir: Path) -> tuple[Optional[Path], Optional[Path]]:
     """Finds the latest recording's wav and cue path."""
-    sorted_files = sorted(recordings_dir.iterdir(), key=lambda f: f.name, reverse=True)
-    for wav_path, cue_path in zip(sorted_files, sorted_files[1:]):
-        if wav_path.name.endswith('.wav') and cue_path.name.endswith('.cue'):
-            return wav_path, cue_path
-    return None, None
+    wavs: dict[str, str] = {}
+    cues: dict[str, str] = {}
+    with os.scandir(recordings_dir) as entries:
+        for entry in entries:
+            suffix = entry.name[-4:]
+            if suffix == '.wav' and entry.is_file():
+                wavs[entry.name[:-4]] = entry.path
+            elif suffix == '.cue' and entry.is_file():
+                cues[entry.name[:-4]] = entry.path
+    latest = max(wavs.keys() & cues.keys(), default=None)
+    if latest is None:
+        return None, None
+    return Path(wavs[latest]), Path(cues[latest])
+
+def prune_transcodes_cache(cache_dir: Path, size: int=TRANSCODES_CACHE_SIZE):
+    """Removes all but the given number of most recently used transcodes from the cache, along with stale temporary files."""
+    now = time.time()
+    transcodes: list[tuple[float, str]] = []
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            mtime = entry.stat().st_mtime
+            if entry.name.endswith('.mp3'):
+                transcodes.append((mtime, entry.path))
+            elif entry.name.endswith('.tmp') and now - mtime > STALE_TEMPORARY_FILE_AGE:
+                os.unlink(entry.path)
+    transcodes.sort(reverse=True)
+    for _, path in transcodes[size:]:
+        os.unlink(path)
+
+def fetch_mixes(mixcloud: 'Mixcloud', cache_path: Optional[Path]) -> list[dict]:
+    """Fetches the user's mixes, reusing a recently cached list (of the same account) if available."""
+    # Identify the account by a hash of the access token to avoid storing the token itself
+    account = hashlib.sha256(mixcloud.access_token.encode()).hexdigest()
+
+    if cache_path:
+        try:
+            cache = read_json(cache_path)
+        except (OSError, ValueError):
+            # Treat an unreadable or corrupt cache as a miss
+            cache = None
+        if (
+            isinstance(cache, dict)
+            and cache.get('account') == account
+            and isinstance(cache.get('mixes'), list)
+            and all(isinstance(mix, dict) and isinstance(mix.get('name'), str) for mix in cache['mixes'])
+            and isinstance(cache.get('timestamp'), (int, float))
+            and time.time() - cache['timestamp'] < MIXES_CACHE_TTL
+        ):
+            return cache['mixes']
+
+    # Only cache the fields that are actually used
+    mixes = [{'name': mix['name']} for mix in mixcloud.cloudcasts().get('data', [])]
 
-def find_next_name(pattern: str, mixcloud: Mixcloud) -> str:
+    if cache_path:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomically(cache_path, format_json({'account': account, 'timestamp': time.time(), 'mixes': mixes}))
+        except OSError:
+            # The cache is optional, e.g. the cache directory may be read-only
+            pass
+
+    return mixes
+
+def find_next_name(pattern: str, mixes: list[dict]) -> str:
     """
     Finds the 'next' name for a mix given a naming pattern (regex).
     The pattern should have at most one capturing group for capturing an index/number.
     """
-    mixes = mixcloud.cloudcasts().get('data', [])
-    newest_match = next((match for mix in mixes for match in [re.match(pattern, mix['name'])] if match), None) # TODO: Handle pagination
+    compiled_pattern = re.compile(pattern)
+    newest_match = next((match for mix in mixes for match in [compiled_pattern.match(mix['name'])] if match), None) # TODO: Handle pagination
     newest_number = int(newest_match.group(1)) if newest_match else 0
     next_number = newest_number + 1
-    return re.sub(r'\([^\)]+\)', str(next_number), pattern)
+    return NAME_GROUP_PATTERN.sub(str(next_number), pattern)
 
 def run(opts: Options):
-    # Transcode the audio if needed
-    if opts.output_path.exists():
-        print(f'==> Using cached {opts.output_path}...')
-    else:
-        print(f'==> Transcoding {opts.recording_path} to {opts.output_path}...')
-        transcode(
-            recording_path=opts.recording_path,
-            output_path=opts.output_path,
-            trim_duration=opts.trim_duration,
-            fade_in=opts.fade_in,
-            fade_out=opts.fade_out,
-        )
-    
-    # Parse and prompt user to edit the tracklist
-    with open(opts.tracklist_path, 'r') as f:
-        tracks = CuesheetFormat().parse(f.read())
+    from concurrent.futures import ThreadPoolExecutor
+    from tracklist.format.cuesheet import CuesheetFormat
+    from tracklist.format.tabular import TabularFormat
+
+    from mixcloud_uploader.transform import complete_tracklist, trim_tracklist
+    from mixcloud_uploader.transcode import transcode
+
+    # Transcode to a partial file first, so an interrupted transcode is never mistaken for a cached one
+    partial_output_path = opts.output_path.with_name(f'.{opts.output_path.stem}.partial{opts.output_path.suffix}')
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Transcode the audio in the background if needed
+        if opts.output_path.exists():
+            print(f'==> Using cached {opts.output_path}...')
+            transcoding = None
+        elif opts.transcode_cache_path and opts.transcode_cache_path.exists():
+            print(f'==> Using cached {opts.transcode_cache_path}...')
+            link_or_copy(opts.transcode_cache_path, opts.output_path)
+            # Mark the transcode as recently used to keep it from being pruned
+            os.utime(opts.transcode_cache_path)
+            transcoding = None
+        else:
+            print(f'==> Transcoding {opts.recording_path} to {opts.output_path}...')
+            transcoding = executor.submit(
+                transcode,
+                recording_path=opts.recording_path,
+                output_path=partial_output_path,
+                trim_duration=opts.trim_duration,
+                fade_in=opts.fade_in,
+                fade_out=opts.fade_out,
+            )
 
-    # Complete artists
-    tracks = complete_tracklist(tracks)
+        # Parse the tracklist while transcoding
+        tracks = CuesheetFormat().parse(opts.tracklist_path.read_text())
 
-    # Truncate tracklist when trimming
-    if opts.trim_duration:
-        tracks = trim_tracklist(tracks, opts.trim_duration)
+        # Complete artists
+        tracks = complete_tracklist(tracks)
+
+        # Truncate tracklist when trimming
+        if opts.trim_duration:
+            tracks = trim_tracklist(tracks, opts.trim_duration)
+
+        # Wait for the transcode to finish (and propagate its errors) before prompting the user
+        if transcoding:
+            try:
+                transcoding.result()
+            except BaseException:
+                partial_output_path.unlink(missing_ok=True)
+                raise
+            os.replace(partial_output_path, opts.output_path)
+
+            if opts.transcode_cache_path:
+                opts.transcode_cache_path.parent.mkdir(parents=True, exist_ok=True)
+                link_or_copy(opts.output_path, opts.transcode_cache_path)
+                prune_transcodes_cache(opts.transcode_cache_path.parent)
 
     edit_format = TabularFormat(separator=' :: ')
 
     # Open editor for editing the tracklist if not noninteractive
     if not opts.noninteractive:
-        with NamedTemporaryFile(prefix='tracklist-', suffix='.txt', mode='w+t') as tmpfile:
-            editor = os.environ.get('EDITOR', 'vim')
-            path = Path(tmpfile.name)
+        fd, raw_path = mkstemp(prefix='tracklist-', suffix='.txt')
+        path = Path(raw_path)
 
-            with open(path, 'w') as f:
-                f.write(edit_format.format(tracks) + '\n')
+        try:
+            original = (edit_format.format(tracks) + '\n').encode()
+            os.write(fd, original)
+            os.close(fd)
 
-            tmpfile.flush()
-            subprocess.run([editor, str(path)])
+            subprocess.run([*editor_command(), str(path)], check=False)
 
-            with open(path, 'r') as f:
-                new_tracks = edit_format.parse(f.read())
+            # Only reparse the tracklist if the user actually changed it
+            edited = path.read_bytes()
+            if edited != original:
+                new_tracks = edit_format.parse(edited.decode())
 
-            if tracks and not new_tracks:
-                print('Empty tracklist, aborting...')
-                sys.exit(1)
-            tracks = new_tracks
+                if tracks.entries and not new_tracks.entries:
+                    print('Empty tracklist, aborting...')
+                    sys.exit(1)
+                tracks = new_tracks
+        finally:
+            path.unlink()
     
     print('==> Confirming...')
     print(edit_format.format(tracks))
@@ -138,10 +263,14 @@ def run(opts: Options):
     )
     print(result)
 
+    # The cached mixes no longer include the newest one
+    if opts.mixes_cache_path:
+        opts.mixes_cache_path.unlink(missing_ok=True)
+
     print('==> Successfully uploaded mix')
 
 def main():
-    parser = argparse.ArgumentParser(description='CLI tool for uploading Mixxx recordings to Mixcloud')
+    parser = argparse.ArgumentParser(description='CLI tool for uploading Mixxx recordings to Mixcloud', fromfile_prefix_chars='@')
     parser.add_argument('-c', '--config', type=Path, default=DEFAULT_CONFIG_PATH, help='The path to the config.json')
     parser.add_argument('-a', '--auth', type=Path, default=DEFAULT_AUTH_PATH, help='The path to the auth.json')
     parser.add_argument('-rd', '--recordings-dir', type=Path, help='The recordings directory to use.')
@@ -159,6 +288,7 @@ def main():
     parser.add_argument('--trim-duration', type=int, default=None, help='Trims to the given duration in seconds.')
     parser.add_argument('--fade-in', type=int, default=None, help='Adds the given fade-in in seconds.')
     parser.add_argument('--fade-out', type=int, default=None, help='Adds the given fade-out in seconds.')
+    parser.add_argument('--no-transcode-cache', action='store_true', help=f'Disables caching the {TRANSCODES_CACHE_SIZE} most recently used transcoded recordings in {DEFAULT_TRANSCODES_CACHE_DIR}.')
 
     # Parse CLI args
     args = parser.parse_args()
@@ -174,29 +304,23 @@ def main():
     name = args.name
     description = args.description
     artwork_path = args.artwork
-    tags = [tag.strip() for tag in args.tags.split(',')]
+    tags = [tag for tag in TAG_SEPARATOR_PATTERN.split(args.tags.strip()) if tag]
     trim_duration = args.trim_duration
     fade_in = args.fade_in
     fade_out = args.fade_out
+    use_transcode_cache = not args.no_transcode_cache
 
-    # Read config
-    if config_path and config_path.exists():
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-    else:
-        config = {}
-    
-    # Read cached auth
-    if auth_path and auth_path.exists():
-        with open(auth_path, 'r') as f:
-            auth = json.load(f)
-    else:
-        auth = {}
+    from mixcloud_uploader.mixcloud import Mixcloud, authenticate_via_browser
+    from mixcloud_uploader.transcode import transcode_cache_key
+
+    # Read config and cached auth
+    config = read_json(config_path)
+    auth = read_json(auth_path)
 
     # Set defaults from stored config/auth
     raw_recordings_dir = config.get('recordings-dir', str(DEFAULT_RECORDINGS_PATH))
     raw_output_dir = config.get('output-dir', None)
-    recordings_dir = recordings_dir or Path(raw_recordings_dir)
+    recordings_dir = (recordings_dir or Path(raw_recordings_dir)).expanduser()
     output_dir = output_dir or (Path(raw_output_dir) if raw_output_dir else None)
     access_token = access_token or auth.get('access-token', None)
     client_id = client_id or auth.get('client-id', None)
@@ -218,8 +342,8 @@ def main():
         # Cache access token
         if auth_path:
             auth['access-token'] = access_token
-            with open(auth_path, 'w') as f:
-                json.dump(auth, f, indent=2, sort_keys=True)
+            with open(auth_path, 'wb') as f:
+                f.write(format_json(auth))
     
     # Set up API wrapper
     mixcloud = Mixcloud(access_token)
@@ -232,14 +356,17 @@ def main():
             sys.exit(1)
         preset = presets.get(preset_key, {})
         name_pattern = preset.get('name', None)
-        next_name = find_next_name(name_pattern, mixcloud) if name_pattern else None
+        # Only query the existing mixes if the name isn't given explicitly
+        next_name = find_next_name(name_pattern, fetch_mixes(mixcloud, DEFAULT_MIXES_CACHE_PATH)) if name_pattern and not name else None
         name = name or next_name
         description = description or preset.get('description', None)
         artwork = preset.get('artwork', None)
         artwork_path = artwork_path or (Path(artwork) if artwork else None)
-        tags = tags or preset.get('tags', [])
+        tags = tags or [stripped for tag in preset.get('tags', []) if (stripped := tag.strip())]
     else:
         next_name = None
+
+    artwork_path = artwork_path.expanduser() if artwork_path else None
     
     # Handle absence of name
     if not name or (not noninteractive and next_name):
@@ -254,39 +381,44 @@ def main():
         # Use the specified recording
         recording_path = recordings_dir / f'{args.recording_name}.wav'
         tracklist_path = recordings_dir / f'{args.recording_name}.cue'
+
+        if not recording_path.exists():
+            print(f'{recording_path} does not exist!')
+            sys.exit(1)
+        elif not tracklist_path.exists():
+            print(f'{tracklist_path} does not exist!')
+            sys.exit(1)
     else:
-        # Default to latest recording
+        # Default to latest recording (the scan already ensures that both files exist)
         recording_path, tracklist_path = find_latest_recording(recordings_dir)
-    
-    # Handle absence of a recording
-    if not recording_path or not tracklist_path:
-        print('No recording found!')
-        sys.exit(1)
-    elif not recording_path.exists():
-        print(f'{recording_path} does not exist!')
-        sys.exit(1)
-    elif not tracklist_path.exists():
-        print(f'{tracklist_path} does not exist!')
-        sys.exit(1)
+
+        if not recording_path or not tracklist_path:
+            print('No recording found!')
+            sys.exit(1)
     
     with TemporaryDirectory(prefix='mixcloud-uploader-output-') as tmpdir:
         # Use a deterministic output name to allow caching the transcoded audio file.
+        # The key ensures that a re-recorded wav or changed parameters invalidate the cache.
         output_dir = (output_dir or Path(tmpdir)).expanduser()
-        output_path = output_dir / f"transcoded-{recording_path.name.split('.')[0]}.mp3"
+        cache_key = transcode_cache_key(recording_path, trim_duration, fade_in, fade_out)
+        output_path = output_dir / f"transcoded-{recording_path.name.split('.')[0]}-{cache_key}.mp3"
+        transcode_cache_path = DEFAULT_TRANSCODES_CACHE_DIR / f'{cache_key}.mp3' if use_transcode_cache else None
 
         # Ensure that the output directory exists
         output_dir.mkdir(parents=True, exist_ok=True)
 
         opts = Options(
-            recording_path=recording_path.expanduser(),
-            tracklist_path=tracklist_path.expanduser(),
-            output_path=output_path.expanduser(),
+            recording_path=recording_path,
+            tracklist_path=tracklist_path,
+            output_path=output_path,
+            transcode_cache_path=transcode_cache_path,
             noninteractive=noninteractive,
             mixcloud=mixcloud,
+            mixes_cache_path=DEFAULT_MIXES_CACHE_PATH,
             name=name,
             description=description,
-            artwork_path=artwork_path.expanduser() if artwork_path else None,
-            tags=[tag.strip() for tag in tags if tag.strip()],
+            artwork_path=artwork_path,
+            tags=tags,
             trim_duration=trim_duration,
             fade_in=fade_in,
             fade_out=fade_out,
@@ -1,14 +1,14 @@
-import contextlib
-import time
 import requests
 import webbrowser
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse, parse_qs, quote_plus
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlencode, urlparse, parse_qs
 from pathlib import Path
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 from tracklist.model import Tracklist
 from threading import Thread
-from typing import Optional
+from typing import Any, Optional
 
 class Mixcloud:
     """A wrapper around the Mixcloud API."""
@@ -17,17 +17,23 @@ class Mixcloud:
 
     def __init__(self, access_token: str):
         self.access_token = access_token
+        self._cloudcasts: dict[str, dict] = {}
+
+        # Reuse connections across requests and pass the token with every request
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        self._session.params = {'access_token': access_token}
     
-    def request(self, method: str, endpoint: str, query: Optional[dict[str, str]]=None, files: Optional[dict]=None, data: Optional[dict]=None) -> requests.Response:
+    def request(self, method: str, endpoint: str, query: Optional[dict[str, str]]=None, files: Optional[dict]=None, data: Optional[Any]=None, headers: Optional[dict[str, str]]=None) -> requests.Response:
         """Performs an authenticated request against the API."""
-        query = dict(query or {}, access_token=self.access_token)
-        encoded_query = '&'.join(f'{quote_plus(k)}={quote_plus(v)}' for k, v in query.items())
-        url = f'{Mixcloud.API_BASE_URL}{endpoint}?{encoded_query}'
-        return requests.request(method, url, files=files, data=data)
+        url = f'{Mixcloud.API_BASE_URL}{endpoint}'
+        return self._session.request(method, url, params=query, files=files, data=data, headers=headers)
     
     def cloudcasts(self, user: str='me') -> dict:
-        """Fetches the given user's mixes."""
-        return self.request('GET', f'/{user}/cloudcasts').json()
+        """Fetches the given user's mixes (cached per instance)."""
+        if user not in self._cloudcasts:
+            self._cloudcasts[user] = self.request('GET', f'/{user}/cloudcasts').json()
+        return self._cloudcasts[user]
     
     def upload(
         self,
@@ -39,32 +45,45 @@ class Mixcloud:
         tracks: Optional[Tracklist]=None,
     ):
         """Uploads a mix."""
+        fields: list[tuple[str, Any]] = [('name', name)]
+        if description:
+            fields.append(('description', description))
+        for i, tag in enumerate(tags or []):
+            fields.append((f'tags-{i}-tag', tag))
+        for i, track in enumerate(tracks.entries if tracks else []):
+            if track.artist:
+                fields.append((f'sections-{i}-artist', track.artist))
+            if track.title:
+                fields.append((f'sections-{i}-song', track.title))
+            # Note that a start time of 0 is valid too
+            fields.append((f'sections-{i}-start_time', str(track.start_seconds)))
+
         with open(audio_file_path, 'rb') as audio_file:
-            with (open(artwork_path, 'rb') if artwork_path else contextlib.nullcontext()) as artwork_file:
-                response = self.request(
-                    'POST', '/upload/',
-                    files={k: v for k, v in [
-                        ('mp3', audio_file),
-                        ('picture', artwork_file),
-                    ] if v},
-                    data={k: v for k, v in [
-                        ('name', name),
-                        ('description', description),
-                        *((f'tags-{i}-tag', tag) for i, tag in enumerate(tags or [])),
-                        *(section for i, track in enumerate(tracks.entries if tracks else []) for section in [
-                            (f'sections-{i}-artist', track.artist),
-                            (f'sections-{i}-song', track.title),
-                            (f'sections-{i}-start_time', track.start_seconds),
-                        ]),
-                    ] if v}
-                )
-                response.raise_for_status()
-                return response.json()
+            fields.append(('mp3', (audio_file_path.name, audio_file, 'audio/mpeg')))
+            if artwork_path:
+                with open(artwork_path, 'rb') as artwork_file:
+                    fields.append(('picture', (artwork_path.name, artwork_file)))
+                    return self._post_upload(fields)
+            else:
+                return self._post_upload(fields)
+
+    def _post_upload(self, fields: list[tuple[str, Any]]):
+        """Posts the given upload fields, including opened files."""
+        # Stream the multipart body rather than loading the files into memory
+        encoder = MultipartEncoder(fields=fields)
+        response = self.request(
+            'POST', '/upload/',
+            data=encoder,
+            headers={'Content-Type': encoder.content_type},
+        )
+        response.raise_for_status()
+        return response.json()
     
 def authenticate_via_browser(client_id: str, client_secret: str) -> str:
     """Obtains an OAuth2 access token by authenticating via the browser."""
 
     callback_endpoint = '/callback'
+    callback_received = False
     oauth_code = None
 
     class RequestHandler(BaseHTTPRequestHandler):
@@ -74,40 +93,42 @@ def authenticate_via_browser(client_id: str, client_secret: str) -> str:
             if url.path == callback_endpoint:
                 query = parse_qs(url.query)
 
+                nonlocal callback_received, oauth_code
+                callback_received = True
                 if 'code' in query:
-                    nonlocal oauth_code
                     oauth_code = query['code'][0]
 
-                    def shutdown_soon():
-                        time.sleep(1)
-                        self.server.shutdown()
-
-                    Thread(target=shutdown_soon).start()
-
                 self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b'OK, you can close this tab.')
             else:
                 self.send_response(404)
+                self.end_headers()
 
     server = HTTPServer(('127.0.0.1', 0), RequestHandler)
     redirect_uri = f'http://localhost:{server.server_port}{callback_endpoint}'
+    authorize_url = f"https://www.mixcloud.com/oauth/authorize?{urlencode({'client_id': client_id, 'redirect_uri': redirect_uri})}"
 
-    def launch_browser():
-        # We delay execution to make sure that the server is actually running by then
-        time.sleep(1)
-        webbrowser.open(f'https://www.mixcloud.com/oauth/authorize?client_id={client_id}&redirect_uri={quote_plus(redirect_uri)}')
-
+    # The server socket is already listening here, so the browser needs no delay. We still launch it
+    # in a thread since some browsers (e.g. console browsers) block until they exit.
     print('==> Launching browser for authentication...')
-    Thread(target=launch_browser).start()
+    Thread(target=webbrowser.open, args=(authorize_url,), daemon=True).start()
 
     print('==> Waiting for callback...')
-    server.serve_forever()
+    with server:
+        while not callback_received:
+            server.handle_request()
 
     if not oauth_code:
         raise RuntimeError('No OAuth code received!')
 
     print(f'==> Got code {oauth_code}, requesting OAuth access token...')
-    access_token_url = f'https://www.mixcloud.com/oauth/access_token?client_id={client_id}&redirect_uri={quote_plus(redirect_uri)}&client_secret={client_secret}&code={oauth_code}'
-    response = requests.get(access_token_url)
+    response = requests.get('https://www.mixcloud.com/oauth/access_token', params={
+        'client_id': client_id,
+        'redirect_uri': redirect_uri,
+        'client_secret': client_secret,
+        'code': oauth_code,
+    })
     response_fields = response.json()
 
     if 'access_token' in response_fields:
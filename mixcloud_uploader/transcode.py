@@ -1,10 +1,48 @@
-import ffmpeg
+import functools
+import hashlib
+import os
+import struct
 import subprocess
 
 from pathlib import Path
 from typing import Optional
 
-def get_duration(recording_path: Path) -> float:
+# The codec and bitrate of the transcoded mp3.
+AUDIO_CODEC = 'libmp3lame'
+AUDIO_BITRATE = '192k'
+
+def read_wav_duration(recording_path: Path) -> Optional[float]:
+    """Reads the duration from a RIFF/WAVE header, if possible."""
+    with open(recording_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            return None
+
+        byte_rate = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            padded_size = chunk_size + chunk_size % 2
+
+            if chunk_id == b'fmt ':
+                fmt = f.read(padded_size)
+                if len(fmt) < 12:
+                    return None
+                # The fmt chunk starts with the format tag, channels, sample rate and byte rate
+                _, _, _, byte_rate = struct.unpack_from('<HHII', fmt)
+            elif chunk_id == b'data':
+                if not byte_rate or chunk_size in (0, 0xFFFFFFFF):
+                    return None
+                # Recordings may have been cut off, therefore we clamp to the actual file size
+                data_size = min(chunk_size, os.fstat(f.fileno()).st_size - f.tell())
+                return data_size / byte_rate
+            else:
+                f.seek(padded_size, os.SEEK_CUR)
+
+def probe_duration(recording_path: Path) -> float:
+    """Probes the duration using ffprobe."""
     raw = subprocess.run(
         [
             'ffprobe',
@@ -18,6 +56,28 @@ def get_duration(recording_path: Path) -> float:
     ).stdout
     return float(raw)
 
+@functools.lru_cache
+def cached_duration(recording_path: Path, mtime_ns: int, size: int) -> float:
+    """Determines the duration, cached by the recording's path, mtime and size."""
+    duration = read_wav_duration(recording_path)
+    if duration is None:
+        duration = probe_duration(recording_path)
+    return duration
+
+def get_duration(recording_path: Path) -> float:
+    """Determines the duration, preferably from the wav header to avoid spawning ffprobe."""
+    st = os.stat(recording_path)
+    return cached_duration(recording_path, st.st_mtime_ns, st.st_size)
+
+def transcode_cache_key(recording_path: Path, trim_duration: Optional[float], fade_in: Optional[float], fade_out: Optional[float]) -> str:
+    """
+    Derives a key identifying a transcode from the recording's metadata and the transcoding parameters.
+    Using the stat info avoids having to read the (potentially large) recording.
+    """
+    st = os.stat(recording_path)
+    raw = f'{recording_path.resolve()}|{st.st_mtime_ns}|{st.st_size}|{trim_duration}|{fade_in}|{fade_out}|{AUDIO_CODEC}|{AUDIO_BITRATE}'
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
 def transcode(
     recording_path: Path,
     output_path: Path,
@@ -30,13 +90,30 @@ def transcode(
     duration = get_duration(recording_path)
     print(f'Duration: {duration}')
 
-    builder = ffmpeg.input(str(recording_path))
+    filters = []
 
+    # Trimming happens on the input side (see below), so the fade-out is relative to the trimmed stream
     if trim_duration:
-        builder = builder.filter('atrim', duration=trim_duration)
+        duration = min(duration, trim_duration)
     if fade_in:
-        builder = builder.filter('afade', type='in', duration=fade_in)
+        filters.append(f'afade=type=in:duration={fade_in}')
     if fade_out:
-        builder = builder.filter('afade', type='out', duration=fade_out, start_time=duration - fade_out)
+        filters.append(f'afade=type=out:duration={fade_out}:start_time={duration - fade_out}')
 
-    builder.output(str(output_path)).run(overwrite_output=True)
+    subprocess.run(
+        [
+            'ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'error',
+            '-y',
+            # Passing the duration as an input option lets ffmpeg stop reading at the cut instead of decoding the rest
+            *(['-t', str(trim_duration)] if trim_duration else []),
+            '-i', str(recording_path),
+            *(['-af', ','.join(filters)] if filters else []),
+            '-c:a', AUDIO_CODEC,
+            '-b:a', AUDIO_BITRATE,
+            '-threads', '0',
+            str(output_path),
+        ],
+        check=True
+    )
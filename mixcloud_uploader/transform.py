@@ -3,17 +3,19 @@ import re
 from dataclasses import replace
 from tracklist.model import TrackEntry, Tracklist
 
+# Matches the separator between artist and title (including surrounding whitespace).
+ARTIST_SEPARATOR_PATTERN = re.compile(r'\s*(?:[-–]|:|\bby\b)\s*')
+
 def complete_entry(entry: TrackEntry) -> TrackEntry:
     """Attempts to guess the artist from the title if empty."""
     if not entry.artist:
-        for pattern in [r'[-–]', r':', r'by']:
-            split = re.split(pattern, entry.title, maxsplit=1)
-            if len(split) >= 2:
-                return replace(
-                    entry,
-                    artist=split[0].strip(),
-                    title=split[1].strip(),
-                )
+        split = ARTIST_SEPARATOR_PATTERN.split(entry.title.strip(), maxsplit=1)
+        if len(split) == 2:
+            return TrackEntry(
+                artist=split[0],
+                title=split[1],
+                start_seconds=entry.start_seconds,
+            )
     return entry
 
 def complete_tracklist(tracklist: Tracklist) -> Tracklist:
@@ -1,27 +1,112 @@
+import json
+import os
+import shutil
 import sys
 
-from typing import Optional
+from pathlib import Path
+from tempfile import mkstemp
+from typing import Any, Iterable, Optional
+
+def parse_json(raw: bytes) -> Any:
+    """Parses JSON, using orjson if available."""
+    # orjson is imported lazily to keep it off the startup path
+    try:
+        import orjson # pyright: ignore[reportMissingImports]
+    except ImportError:
+        return json.loads(raw)
+    return orjson.loads(raw)
+
+def format_json(value: Any) -> bytes:
+    """Pretty-prints JSON with sorted keys, using orjson if available."""
+    try:
+        import orjson # pyright: ignore[reportMissingImports]
+    except ImportError:
+        return json.dumps(value, indent=2, sort_keys=True).encode()
+    return orjson.dumps(value, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+
+def read_json(path: Optional[Path]) -> Any:
+    """Reads the JSON file at the given path, defaulting to an empty object if it doesn't exist."""
+    if not path:
+        return {}
+    try:
+        return parse_json(path.read_bytes())
+    except FileNotFoundError:
+        return {}
+
+def write_atomically(path: Path, data: bytes):
+    """Writes the file via a temporary file in the same directory, so readers never see partial contents."""
+    fd, raw_tmp_path = mkstemp(prefix=f'.{path.name}-', suffix='.tmp', dir=path.parent)
+    tmp_path = Path(raw_tmp_path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def copy_atomically(source: Path, destination: Path):
+    """Copies the file via a temporary file in the destination directory, so readers never see partial contents."""
+    fd, raw_tmp_path = mkstemp(prefix=f'.{destination.name}-', suffix='.tmp', dir=destination.parent)
+    os.close(fd)
+    tmp_path = Path(raw_tmp_path)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def link_or_copy(source: Path, destination: Path):
+    """Hard-links the source to the destination, falling back to copying (e.g. across file systems)."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        copy_atomically(source, destination)
+
+def read_line(prompt: str) -> str:
+    """
+    Prompts for a line of input. Uses the builtin input (with line editing) on terminals
+    and reads directly from stdin otherwise, e.g. when piped from a script.
+    """
+    if sys.stdin.isatty():
+        return input(prompt)
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line[:-1] if line.endswith('\n') else line
 
 def input_with_default(prompt: str, default: Optional[str]) -> str:
     if default:
-        response = input(f'{prompt} [default: {default}] ').strip()
+        response = read_line(f'{prompt} [default: {default}] ').strip()
         return response or default
     else:
+        full_prompt = f'{prompt} '
         response = None
         while not response:
-            response = input(f'{prompt} ')
+            response = read_line(full_prompt)
         return response
 
-def pretty_box(lines: list[str]) -> str:
-    width = max(len(line) for line in lines)
-    hbar = f"+-{width * '-'}-+"
-    return '\n'.join([
-        hbar,
-        *(f'| {line.ljust(width)} |' for line in lines),
-        hbar,
-    ])
+def pretty_box(lines: Iterable[str]) -> str:
+    # Materialize the lines once, so generators work too
+    measured = [(line, len(line)) for line in lines]
+
+    # Fast path for the common case of a single (status) line
+    if len(measured) == 1:
+        line, width = measured[0]
+        hbar = '+' + '-' * (width + 2) + '+'
+        return f'{hbar}\n| {line} |\n{hbar}'
+
+    width = max((length for _, length in measured), default=0)
+    hbar = '+' + '-' * (width + 2) + '+'
+    parts = [hbar]
+    parts.extend(f"| {line}{' ' * (width - length)} |" for line, length in measured)
+    parts.append(hbar)
+    return '\n'.join(parts)
 
 def confirm(prompt: str):
-    response = input(f'{prompt} [y/n] ').strip().lower()
+    response = read_line(f'{prompt} [y/n] ').strip().lower()
     if response and response != 'y':
         sys.exit(1)